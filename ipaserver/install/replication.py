@@ -19,6 +19,8 @@
 
 from __future__ import print_function, absolute_import
 
+import concurrent.futures
+import contextlib
 import logging
 import itertools
 
@@ -31,6 +33,7 @@ import os
 from random import randint
 
 import ldap
+from ldap.controls import LDAPControl
 
 from ipalib import api, errors
 from ipalib.cli import textui
@@ -61,6 +64,14 @@ REPL_MANAGERS_CN = DN(('cn', 'replication managers'))
 IPA_REPLICA = 1
 WINSYNC = 2
 
+# Terminal nsds5ReplicaLastInitStatus values, matched in a single pass
+# by check_repl_init()
+_REPL_INIT_STATUS_RE = re.compile('replica busy|Total update succeeded')
+
+# Subtree Delete control (OID 1.2.840.113556.1.4.805): the server walks
+# and removes a whole subtree in a single delete operation
+_TREE_DELETE_CTRL = LDAPControl('1.2.840.113556.1.4.805', True)
+
 # List of attributes that need to be excluded from replication initialization.
 TOTAL_EXCLUDES = ('entryusn',
                  'krblastsuccessfulauth',
@@ -76,6 +87,13 @@ STRIP_ATTRS = ('modifiersName',
                'internalModifiersName',
                'internalModifyTimestamp')
 
+# Agreement attribute values precomputed from the tuples above; used by
+# setup_agreement for every agreement it creates
+_EXCLUDES_VALUE = '(objectclass=*) $ EXCLUDE %s' % " ".join(EXCLUDES)
+_TOTAL_EXCLUDES_VALUE = '(objectclass=*) $ EXCLUDE %s' % " ".join(
+    TOTAL_EXCLUDES)
+_STRIP_ATTRS_VALUE = " ".join(STRIP_ATTRS)
+
 # settings for cn=replica,cn=$DB,cn=mapping tree,cn=config
 # during replica installation
 REPLICA_CREATION_SETTINGS = {
@@ -91,6 +109,51 @@ REPLICA_FINAL_SETTINGS = {
 }
 
 
+@contextlib.contextmanager
+def _referrals_disabled(conn):
+    """Turn off referral chasing on a connection for the duration.
+
+    libldap follows chased referrals with anonymous rebinds, which would
+    stall in the middle of a pipelined delete sequence.
+    """
+    prev = conn.conn.get_option(ldap.OPT_REFERRALS)
+    conn.conn.set_option(ldap.OPT_REFERRALS, 0)
+    try:
+        yield
+    finally:
+        conn.conn.set_option(ldap.OPT_REFERRALS, prev)
+
+
+@contextlib.contextmanager
+def _cleanup_phase(force, err_box):
+    """Shared exception handling for the replica_cleanup phases.
+
+    A missing entry never fails a phase. Any other error aborts the
+    cleanup unless force is set, in which case the first error is kept
+    in err_box[0] for the caller to re-raise at the end.
+    """
+    try:
+        yield
+    except errors.NotFound:
+        pass
+    except Exception as e:
+        if not force:
+            raise
+        err_box[0] = err_box[0] or e
+
+
+def _group_entries_by_depth(entries):
+    """Bucket entries by DN depth in a single pass.
+
+    Returns the buckets ordered deepest first, so that iterating over
+    them deletes children before their parents.
+    """
+    buckets = {}
+    for entry in entries:
+        buckets.setdefault(len(entry.dn), []).append(entry)
+    return [buckets[depth] for depth in sorted(buckets, reverse=True)]
+
+
 def replica_conn_check(master_host, host_name, realm, check_ca,
                        dogtag_master_ds_port, admin_password=None,
                        principal="admin", ca_cert_file=None):
@@ -248,6 +311,18 @@ class ReplicationManager:
         self.need_memberof_fixup = False
         self.db_suffix = self.suffix
         self.agreement_name_format = "meTo%s"
+        self._replica_dn = None
+        self._agreement_filters = {}
+        self._multimaster_plugin_path = None
+        # DNs replica_cleanup has already confirmed gone; lets a forced
+        # re-run skip deletes that cannot succeed a second time
+        self._cleanup_gone = set()
+        # Bound connections to remote masters, keyed by (hostname,
+        # bind DN). Binds (especially GSSAPI) dominate the cost of the
+        # short LDAP sessions the setup methods open, so hand out an
+        # already-bound connection when the same remote is contacted
+        # again within this manager's lifetime.
+        self._remote_conns = {}
 
         # The caller is allowed to pass in an existing LDAPClient connection.
         # Open a new one if not provided
@@ -276,6 +351,49 @@ class ReplicationManager:
         self.repl_man_group_dn = DN(
             REPL_MANAGERS_CN, api.env.container_sysaccounts, api.env.basedn)
 
+        # DNs derived only from the suffix, rebuilt on every
+        # replica_cleanup call otherwise
+        self._s4u2proxy_targets = (
+            (DN(('cn', 'ipa-http-delegation'),
+                api.env.container_s4u2proxy, self.suffix), 'HTTP'),
+            (DN(('cn', 'ipa-ldap-delegation-targets'),
+                api.env.container_s4u2proxy, self.suffix), 'ldap'),
+            (DN(('cn', 'ipa-cifs-delegation-targets'),
+                api.env.container_s4u2proxy, self.suffix), 'cifs'),
+        )
+        self._masters_container_dn = DN(
+            api.env.container_masters, self.suffix)
+        self._default_profile_dn = DN(('cn', 'default'), ('ou', 'profile'),
+                                      self.suffix)
+
+    def _get_remote_conn(self, r_hostname, r_binddn=None, r_bindpw=None,
+                         cacert=paths.IPA_CA_CRT):
+        """
+        Return a bound LDAP connection to a remote master, reusing a
+        previously bound one to the same host and bind DN if it is
+        still alive.
+        """
+        key = (r_hostname, r_binddn)
+        r_conn = self._remote_conns.get(key)
+        if r_conn is not None:
+            try:
+                r_conn.conn.whoami_s()
+                return r_conn
+            except ldap.LDAPError:
+                # The remote dropped the connection (idle timeout, DS
+                # restart); evict it and bind a fresh one
+                del self._remote_conns[key]
+        # note - there appears to be a bug in python-ldap - it does not
+        # allow connections using two different CA certs
+        r_conn = ipaldap.LDAPClient.from_hostname_secure(
+            r_hostname, cacert=cacert)
+        if r_bindpw:
+            r_conn.simple_bind(r_binddn, r_bindpw)
+        else:
+            r_conn.gssapi_bind()
+        self._remote_conns[key] = r_conn
+        return r_conn
+
     def _get_replica_id(self, conn, master_conn):
         """
         Returns the replica ID which is unique for each backend.
@@ -355,11 +473,21 @@ class ReplicationManager:
         """
         Get an LDAP replication agreement filter with a possibility to filter
         the agreements by their type and a host
+
+        The filters only depend on the arguments and on db_suffix, so
+        they are built once per instance and reused by the find_*
+        methods.
         """
         if agreement_types is None:
             agreement_types = (IPA_REPLICA, WINSYNC)
         elif not isinstance(agreement_types, (list, tuple)):
             agreement_types = (agreement_types,)
+        agreement_types = tuple(agreement_types)
+
+        try:
+            return self._agreement_filters[(agreement_types, host)]
+        except KeyError:
+            pass
 
         agreement_types_filters = []
         if IPA_REPLICA in agreement_types:
@@ -375,6 +503,7 @@ class ReplicationManager:
         if host is not None:
             agreement_filter = '(&%s(nsDS5ReplicaHost=%s))' % (agreement_filter, host)
 
+        self._agreement_filters[(agreement_types, host)] = agreement_filter
         return agreement_filter
 
     def find_replication_agreements(self):
@@ -392,7 +521,7 @@ class ReplicationManager:
         try:
             ents = self.conn.get_entries(
                 DN(('cn', 'mapping tree'), ('cn', 'config')),
-                ldap.SCOPE_SUBTREE, filt)
+                ldap.SCOPE_SUBTREE, filt, paged_search=True)
         except errors.NotFound:
             ents = []
         return ents
@@ -409,7 +538,7 @@ class ReplicationManager:
         try:
             ents = self.conn.get_entries(
                 DN(('cn', 'mapping tree'), ('cn', 'config')),
-                ldap.SCOPE_SUBTREE, filt)
+                ldap.SCOPE_SUBTREE, filt, paged_search=True)
         except errors.NotFound:
             ents = []
 
@@ -443,14 +572,13 @@ class ReplicationManager:
         Create a pseudo user to use for replication.
         """
         assert isinstance(dn, DN)
-        rdn_attr = dn[0].attr
-        rdn_val = dn[0].value
+        rdn = dn[0]
 
         ent = conn.make_entry(
             dn,
             {
                 'objectclass': ["top", "person"],
-                rdn_attr: [rdn_val],
+                rdn.attr: [rdn.value],
                 'userpassword': [pw],
                 'sn': ["replication manager pseudo user"],
             }
@@ -475,8 +603,13 @@ class ReplicationManager:
             return "2"
 
     def replica_dn(self):
-        return DN(('cn', 'replica'), ('cn', self.db_suffix),
-                  ('cn', 'mapping tree'), ('cn', 'config'))
+        # The result only depends on db_suffix, which subclasses set
+        # before the first call, so build the DN once and reuse it; this
+        # is called from the wait loops via agreement_dn().
+        if self._replica_dn is None:
+            self._replica_dn = DN(('cn', 'replica'), ('cn', self.db_suffix),
+                                  ('cn', 'mapping tree'), ('cn', 'config'))
+        return self._replica_dn
 
     def _set_replica_binddngroup(self, r_conn, entry):
         """
@@ -509,33 +642,33 @@ class ReplicationManager:
         assert isinstance(dn, DN)
 
         logger.debug("Add or update replica config %s", dn)
+        # Optimistically try the add first; in the common case the entry
+        # does not exist yet and this saves the existence-check
+        # round-trip. If the add collides, fetch what is there and merge
+        # into it below.
+        entry = conn.make_entry(
+            dn,
+            objectclass=["top", "nsds5replica", "extensibleobject"],
+            cn=["replica"],
+            nsds5replicaroot=[str(self.db_suffix)],
+            nsds5replicaid=[str(replica_id)],
+            nsds5replicatype=[self.get_replica_type()],
+            nsds5flags=["1"],
+            nsds5replicabinddn=[replica_binddn],
+            nsds5replicabinddngroup=[self.repl_man_group_dn],
+            nsds5replicalegacyconsumer=["off"],
+            **REPLICA_CREATION_SETTINGS
+        )
         try:
+            conn.add_entry(entry)
+        except errors.DuplicateEntry:
+            logger.debug("Replica config %s exists, updating", dn)
+            # fetch the entry added by us earlier or by another replica
             entry = conn.get_entry(dn)
-        except errors.NotFound:
-            # no entry, create new one
-            entry = conn.make_entry(
-                dn,
-                objectclass=["top", "nsds5replica", "extensibleobject"],
-                cn=["replica"],
-                nsds5replicaroot=[str(self.db_suffix)],
-                nsds5replicaid=[str(replica_id)],
-                nsds5replicatype=[self.get_replica_type()],
-                nsds5flags=["1"],
-                nsds5replicabinddn=[replica_binddn],
-                nsds5replicabinddngroup=[self.repl_man_group_dn],
-                nsds5replicalegacyconsumer=["off"],
-                **REPLICA_CREATION_SETTINGS
-            )
-            try:
-                conn.add_entry(entry)
-            except errors.DuplicateEntry:
-                logger.debug("Lost race against another replica, updating")
-                # fetch entry that have been added by another replica
-                entry = conn.get_entry(dn)
-            else:
-                logger.debug("Added replica config %s", dn)
-                # added entry successfully
-                return entry
+        else:
+            logger.debug("Added replica config %s", dn)
+            # added entry successfully
+            return entry
 
         # either existing entry or lost race
         binddns = entry.setdefault('nsDS5ReplicaBindDN', [])
@@ -566,6 +699,14 @@ class ReplicationManager:
         return entry
 
     def setup_changelog(self, conn):
+        changelog_dn = DN(('cn', 'changelog5'), ('cn', 'config'))
+        # On a master that has set up replication before the changelog
+        # already exists; probe it first so the common rerun path costs
+        # one DN-only read instead of a database-config lookup plus a
+        # failing add
+        if conn.entry_exists(changelog_dn):
+            return
+
         ent = conn.get_entry(
             DN(
                 ('cn', 'config'), ('cn', 'ldbm database'),
@@ -574,7 +715,7 @@ class ReplicationManager:
         dbdir = os.path.dirname(ent.single_value.get('nsslapd-directory'))
 
         entry = conn.make_entry(
-            DN(('cn', 'changelog5'), ('cn', 'config')),
+            changelog_dn,
             {
                 'objectclass': ["top", "extensibleobject"],
                 'cn': ["changelog5"],
@@ -643,34 +784,45 @@ class ReplicationManager:
         chaindn = DN(('cn', 'chaining database'), ('cn', 'plugins'), ('cn', 'config'))
         benamebase = "chaindb"
         urls = [conn.ldap_uri]
-        cn = ""
-        benum = 1
-        done = False
-        while not done:
+        # Find the first free backend name with a single directed search
+        # instead of probing chaindb1, chaindb2, ... with repeated adds
+        try:
+            ents = self.conn.get_entries(
+                chaindn, ldap.SCOPE_ONELEVEL, '(cn=%s*)' % benamebase, ['cn'])
+        except errors.NotFound:
+            ents = []
+        used = [
+            int(ent.single_value['cn'][len(benamebase):])
+            for ent in ents
+            if ent.single_value.get('cn', '').startswith(benamebase)
+            and ent.single_value['cn'][len(benamebase):].isdigit()
+        ]
+        benum = max(used, default=0) + 1
+        while True:
+            cn = benamebase + str(benum) # e.g. chaindb1
+            dn = DN(('cn', cn), chaindn)
+            entry = conn.make_entry(
+                dn,
+                {
+                    'objectclass': [
+                        'top', 'extensibleObject', 'nsBackendInstance'],
+                    'cn': [cn],
+                    'nsslapd-suffix': [str(self.db_suffix)],
+                    'nsfarmserverurl': urls,
+                    'nsmultiplexorbinddn': [self.repl_man_dn],
+                    'nsmultiplexorcredentials': [self.repl_man_passwd],
+                }
+            )
             try:
-                cn = benamebase + str(benum) # e.g. localdb1
-                dn = DN(('cn', cn), chaindn)
-                entry = conn.make_entry(
-                    dn,
-                    {
-                        'objectclass': [
-                            'top', 'extensibleObject', 'nsBackendInstance'],
-                        'cn': [cn],
-                        'nsslapd-suffix': [str(self.db_suffix)],
-                        'nsfarmserverurl': urls,
-                        'nsmultiplexorbinddn': [self.repl_man_dn],
-                        'nsmultiplexorcredentials': [self.repl_man_passwd],
-                    }
-                )
                 self.conn.add_entry(entry)
-                done = True
             except errors.DuplicateEntry:
+                # raced against a concurrent setup, try the next name
                 benum += 1
             except errors.ExecutionError as e:
                 print("Could not add backend entry " + dn, e)
                 raise
-
-        return cn
+            else:
+                return cn
 
     def setup_chaining_farm(self, conn):
         try:
@@ -694,15 +846,27 @@ class ReplicationManager:
             raise
 
 
+    def _get_multimaster_plugin_path(self):
+        """
+        Return nsslapd-pluginPath of the Multimaster Replication Plugin.
+
+        The path is immutable for the life of the DS, so it is fetched
+        only once per manager.
+        """
+        if self._multimaster_plugin_path is None:
+            plgent = self.conn.get_entry(
+                DN(('cn', 'Multimaster Replication Plugin'), ('cn', 'plugins'),
+                   ('cn', 'config')),
+                ['nsslapd-pluginPath'])
+            self._multimaster_plugin_path = plgent.single_value.get(
+                'nsslapd-pluginPath')
+        return self._multimaster_plugin_path
+
     def enable_chain_on_update(self, bename):
         mtent = self.get_mapping_tree_entry()
         dn = mtent.dn
 
-        plgent = self.conn.get_entry(
-            DN(('cn', 'Multimaster Replication Plugin'), ('cn', 'plugins'),
-               ('cn', 'config')),
-            ['nsslapd-pluginPath'])
-        path = plgent.single_value.get('nsslapd-pluginPath')
+        path = self._get_multimaster_plugin_path()
 
         mod = [(ldap.MOD_REPLACE, 'nsslapd-state', 'backend'),
                (ldap.MOD_ADD, 'nsslapd-backend', bename),
@@ -822,8 +986,7 @@ class ReplicationManager:
             description=["me to %s" % b_hostname],
         )
         if master is None:
-            entry['nsDS5ReplicatedAttributeList'] = [
-                '(objectclass=*) $ EXCLUDE %s' % " ".join(EXCLUDES)]
+            entry['nsDS5ReplicatedAttributeList'] = [_EXCLUDES_VALUE]
         if isgssapi:
             entry['nsds5replicatransportinfo'] = ['LDAP']
             entry['nsds5replicabindmethod'] = ['SASL/GSSAPI']
@@ -836,13 +999,13 @@ class ReplicationManager:
         if iswinsync:
             self.setup_winsync_agmt(entry, win_subtree)
         else:
-            entry['nsds5ReplicaStripAttrs'] = [" ".join(STRIP_ATTRS)]
+            entry['nsds5ReplicaStripAttrs'] = [_STRIP_ATTRS_VALUE]
 
         a_conn.add_entry(entry)
 
         try:
             mod = [(ldap.MOD_ADD, 'nsDS5ReplicatedAttributeListTotal',
-                   '(objectclass=*) $ EXCLUDE %s' % " ".join(TOTAL_EXCLUDES))]
+                   _TOTAL_EXCLUDES_VALUE)]
             a_conn.modify_s(dn, mod)
         except ldap.LDAPError:
             # Apparently there are problems set the total list
@@ -881,6 +1044,10 @@ class ReplicationManager:
         while (retries > 0 ):
             logger.info('Getting ldap service principals for conversion: '
                         '%s and %s', filter_a, filter_b)
+            # The two lookups target different servers on purpose: each
+            # side's principal is read from the peer, proving replication
+            # worked in that direction. They cannot be merged into one
+            # search.
             try:
                 a_entry = b.get_entries(self.suffix, ldap.SCOPE_SUBTREE,
                                         filter=filter_a)
@@ -974,15 +1141,17 @@ class ReplicationManager:
         _cn, b_ag_dn = self.agreement_dn(a.host)
         b.modify_s(b_ag_dn, mod)
 
-        # Finally remove the temporary replication manager user
-        try:
-            a.delete_entry(self.repl_man_dn)
-        except errors.NotFound:
-            pass
-        try:
-            b.delete_entry(self.repl_man_dn)
-        except errors.NotFound:
-            pass
+        # Finally remove the temporary replication manager user. The two
+        # deletes are independent operations against different hosts, so
+        # overlap their round-trips.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [
+                pool.submit(self.delete_replication_manager, conn,
+                            self.repl_man_dn)
+                for conn in (a, b)
+            ]
+            for future in futures:
+                future.result()
 
     def delete_agreement(self, hostname, dn=None):
         """
@@ -1030,14 +1199,15 @@ class ReplicationManager:
             inprogress = entry.single_value.get('nsds5replicaUpdateInProgress')
             status = entry.single_value.get('nsds5ReplicaLastInitStatus')
             if not refresh: # done - check status
+                match = _REPL_INIT_STATUS_RE.search(status) if status else None
                 if not status:
                     print("No status yet")
-                elif status.find("replica busy") > -1:
+                elif match is not None and match.group() == "replica busy":
                     print("[%s] reports: Replica Busy! Status: [%s]"
                           % (conn.ldap_uri, status))
                     done = True
                     hasError = 2
-                elif status.find("Total update succeeded") > -1:
+                elif match is not None:  # Total update succeeded
                     print("\nUpdate succeeded")
                     done = True
                 elif inprogress.lower() == 'true':
@@ -1091,20 +1261,23 @@ class ReplicationManager:
             except (ValueError, TypeError, KeyError):
                 end = 0
             # incremental update is done if inprogress is false and end >= start
-            done = inprogress and inprogress.lower() == 'false' and start <= end
+            # guard against a missing attribute so done stays a boolean
+            done = (inprogress or '').lower() == 'false' and start <= end
             logger.info("Replication Update in progress: %s: status: %s: "
                         "start: %d: end: %d",
                         inprogress, status, start, end)
-            if status: # always check for errors
+            # always check for errors, but skip the parse when the status
+            # already signals success - the common case on quiescent servers
+            if status and not status.startswith('0 '):
                 # status will usually be a number followed by a string
                 # number != 0 means error
                 # Since 389-ds-base 1.3.5 it is 'Error (%d) %s'
                 # so we need to remove a prefix string and parentheses
                 if status.startswith('Error '):
-                    rc, msg = status[6:].split(' ', 1)
+                    rc, _sep, msg = status[6:].partition(' ')
                     rc = rc.strip('()')
                 else:
-                    rc, msg = status.split(' ', 1)
+                    rc, _sep, msg = status.partition(' ')
                 if rc != '0':
                     hasError = 1
                     error_message = msg
@@ -1116,8 +1289,13 @@ class ReplicationManager:
         done = False
         haserror = 0
         start = datetime.datetime.now()
+        # Poll with exponential backoff so that fast initializations are
+        # detected within ~100ms while long ones settle at the previous
+        # one-second interval.
+        interval = 0.1
         while not done and not haserror:
-            time.sleep(1)  # give it a few seconds to get going
+            time.sleep(interval)
+            interval = min(interval * 2, 1.0)
             done, haserror = self.check_repl_init(conn, agmtdn, start)
         print("")
         return haserror
@@ -1126,8 +1304,11 @@ class ReplicationManager:
         done = False
         haserror = 0
         error_message = ''
+        # Poll with exponential backoff, see wait_for_repl_init()
+        interval = 0.1
         while not done and not haserror and maxtries > 0:
-            time.sleep(1)  # give it a few seconds to get going
+            time.sleep(interval)
+            interval = min(interval * 2, 1.0)
             done, haserror, error_message = self.check_repl_update(conn, agmtdn)
             maxtries -= 1
         if maxtries == 0: # too many tries
@@ -1159,41 +1340,42 @@ class ReplicationManager:
         assert isinstance(r_binddn, DN)
         if local_port is None:
             local_port = r_port
-        # note - there appears to be a bug in python-ldap - it does not
-        # allow connections using two different CA certs
-        r_conn = ipaldap.LDAPClient.from_hostname_secure(r_hostname)
-
-        if r_bindpw:
-            r_conn.simple_bind(r_binddn, r_bindpw)
-        else:
-            r_conn.gssapi_bind()
+        r_conn = self._get_remote_conn(r_hostname, r_binddn, r_bindpw)
 
-        #Setup the first half
+        # The replica IDs have to be allocated serially, both touch the
+        # remote master
         l_id = self._get_replica_id(self.conn, r_conn)
-        self.basic_replication_setup(self.conn, l_id,
-                                     self.repl_man_dn, self.repl_man_passwd)
-
-        # Now setup the other half
         r_id = self._get_replica_id(r_conn, r_conn)
-        self.basic_replication_setup(r_conn, r_id,
-                                     self.repl_man_dn, self.repl_man_passwd)
 
-        if is_cs_replica:
-            self.setup_agreement(r_conn, self.hostname, port=local_port,
-                                 repl_man_dn=self.repl_man_dn,
-                                 repl_man_passwd=self.repl_man_passwd,
-                                 master=False)
-            self.setup_agreement(self.conn, r_hostname, port=r_port,
-                                 repl_man_dn=self.repl_man_dn,
-                                 repl_man_passwd=self.repl_man_passwd,
-                                 master=True)
-        else:
-            self.setup_agreement(r_conn, self.hostname, port=local_port,
-                                 repl_man_dn=self.repl_man_dn,
-                                 repl_man_passwd=self.repl_man_passwd)
-            self.setup_agreement(self.conn, r_hostname, port=r_port,
-                                 repl_man_dn=self.repl_man_dn,
-                                 repl_man_passwd=self.repl_man_passwd)
+        # The two halves are independent of each other until
+        # start_replication and each talks to a different server over its
+        # own connection, so overlap their round-trips instead of running
+        # them back to back. The same goes for the two agreements, which
+        # only depend on both replica entries existing.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [
+                pool.submit(self.basic_replication_setup, self.conn, l_id,
+                            self.repl_man_dn, self.repl_man_passwd),
+                pool.submit(self.basic_replication_setup, r_conn, r_id,
+                            self.repl_man_dn, self.repl_man_passwd),
+            ]
+            for future in futures:
+                future.result()
+
+            futures = [
+                pool.submit(self.setup_agreement, r_conn, self.hostname,
+                            port=local_port,
+                            repl_man_dn=self.repl_man_dn,
+                            repl_man_passwd=self.repl_man_passwd,
+                            master=False if is_cs_replica else None),
+                pool.submit(self.setup_agreement, self.conn, r_hostname,
+                            port=r_port,
+                            repl_man_dn=self.repl_man_dn,
+                            repl_man_passwd=self.repl_man_passwd,
+                            master=True if is_cs_replica else None),
+            ]
+            for future in futures:
+                future.result()
 
         #Finally start replication
         ret = self.start_replication(r_conn, master=False)
@@ -1312,11 +1494,7 @@ class ReplicationManager:
             raise RuntimeError("Failed to start replication")
 
     def convert_to_gssapi_replication(self, r_hostname, r_binddn, r_bindpw):
-        r_conn = ipaldap.LDAPClient.from_hostname_secure(r_hostname)
-        if r_bindpw:
-            r_conn.simple_bind(r_binddn, r_bindpw)
-        else:
-            r_conn.gssapi_bind()
+        r_conn = self._get_remote_conn(r_hostname, r_binddn, r_bindpw)
 
         # First off make sure servers are in sync so that both KDCs
         # have all principals and their passwords and can release
@@ -1340,11 +1518,7 @@ class ReplicationManager:
         Only usable to connect 2 existing replicas (needs existing kerberos
         principals)
         """
-        r_conn = ipaldap.LDAPClient.from_hostname_secure(r_hostname)
-        if r_bindpw:
-            r_conn.simple_bind(r_binddn, r_bindpw)
-        else:
-            r_conn.gssapi_bind()
+        r_conn = self._get_remote_conn(r_hostname, r_binddn, r_bindpw)
 
         # Allow krb principals to act as replicas
         self.setup_krb_princs_as_replica_binddns(self.conn, r_conn)
@@ -1381,7 +1555,10 @@ class ReplicationManager:
         schedule = entries[0].single_value.get('nsds5replicaupdateschedule')
 
         # On the remote chance of a match. We force a synch to happen right
-        # now by setting the schedule to something and quickly removing it.
+        # now by setting the schedule to something and removing it again.
+        # The agreement plugin evaluates the post-op entry state, so both
+        # edges must arrive as separate modifies; only the sleep between
+        # them is unnecessary.
         if schedule is not None:
             if newschedule == schedule:
                 newschedule = '2358-2359 1'
@@ -1389,7 +1566,6 @@ class ReplicationManager:
                     dn, newschedule)
         mod = [(ldap.MOD_REPLACE, 'nsDS5ReplicaUpdateSchedule', [ newschedule ])]
         conn.modify_s(dn, mod)
-        time.sleep(1)
         logger.info("Deleting schedule %s from agreement %s",
                     newschedule, dn)
         mod = [(ldap.MOD_DELETE, 'nsDS5ReplicaUpdateSchedule', None)]
@@ -1409,6 +1585,42 @@ class ReplicationManager:
 
         return IPA_REPLICA
 
+    def _delete_entries_async(self, entries):
+        """
+        Delete a batch of entries by pipelining all delete requests on
+        one connection and draining the results afterwards, so N deletes
+        cost about one round-trip instead of N. The entries must not be
+        ancestors of one another: the server may process requests from
+        the same connection concurrently.
+        """
+        with self.conn.error_handler():
+            msgids = [
+                self.conn.conn.delete_ext(str(entry.dn))
+                for entry in entries
+            ]
+            for msgid in msgids:
+                self.conn.conn.result(msgid, all=1, timeout=-1)
+
+    def _delete_subtree(self, dn):
+        """
+        Delete an entry and everything below it in one server-side
+        operation using the Subtree Delete control, falling back to a
+        children-first per-entry deletion on servers without the control.
+        """
+        assert isinstance(dn, DN)
+        try:
+            self.conn.conn.delete_ext_s(
+                str(dn), serverctrls=[_TREE_DELETE_CTRL])
+        except ldap.UNAVAILABLE_CRITICAL_EXTENSION:
+            entries = self.conn.get_entries(dn, ldap.SCOPE_SUBTREE,
+                                            attrs_list=[])
+            for entry in itertools.chain.from_iterable(
+                    _group_entries_by_depth(entries)):
+                self.conn.delete_entry(entry)
+        except ldap.LDAPError as e:
+            with self.conn.error_handler():
+                raise e
+
     def replica_cleanup(self, replica, realm, force=False):
         """
         This function removes information about the replica in parts
@@ -1416,121 +1628,95 @@ class ReplicationManager:
         use this replica.
         """
 
-        err = None
+        err_box = [None]
 
         if replica == self.hostname:
             raise RuntimeError("Can't cleanup self")
 
-        # delete master kerberos key and all its svc principals
-        try:
-            entries = self.conn.get_entries(
-                self.suffix, ldap.SCOPE_SUBTREE,
-                filter='(krbprincipalname=*/%s@%s)' % (replica, realm))
-            if entries:
-                entries.sort(key=lambda x: len(x.dn), reverse=True)
-                for entry in entries:
-                    self.conn.delete_entry(entry)
-        except errors.NotFound:
-            pass
-        except Exception as e:
-            if not force:
-                raise e
-            else:
-                err = e
-
-        # remove replica memberPrincipal from s4u2proxy configuration
-        dn1 = DN(('cn', 'ipa-http-delegation'), api.env.container_s4u2proxy, self.suffix)
-        member_principal1 = "HTTP/%(fqdn)s@%(realm)s" % dict(fqdn=replica, realm=realm)
-
-        dn2 = DN(('cn', 'ipa-ldap-delegation-targets'), api.env.container_s4u2proxy, self.suffix)
-        member_principal2 = "ldap/%(fqdn)s@%(realm)s" % dict(fqdn=replica, realm=realm)
-
-        dn3 = DN(('cn', 'ipa-cifs-delegation-targets'), api.env.container_s4u2proxy, self.suffix)
-        member_principal3 = "cifs/%(fqdn)s@%(realm)s" % dict(fqdn=replica, realm=realm)
+        with _referrals_disabled(self.conn):
+            # One suffix-wide search serves both the principal cleanup here
+            # and the dnaHostname cleanup below; the matches are partitioned
+            # locally by whether they carry a krbprincipalname. Only that
+            # attribute is pulled over the wire, and the result is paged in
+            # case the master being decommissioned has many principals.
+            principal_entries = []
+            dna_entries = []
+            entries = []
+            with _cleanup_phase(force, err_box):
+                entries = self.conn.get_entries(
+                    self.suffix, ldap.SCOPE_SUBTREE,
+                    filter='(|(krbprincipalname=*/%s@%s)(dnaHostname=%s))'
+                           % (replica, realm, replica),
+                    attrs_list=['krbprincipalname'], paged_search=True)
+            for entry in entries:
+                if 'krbprincipalname' in entry:
+                    principal_entries.append(entry)
+                else:
+                    dna_entries.append(entry)
+
+            # delete master kerberos key and all its svc principals; entries
+            # of equal depth cannot be ancestors of one another, so each
+            # depth level is deleted as one pipelined batch
+            with _cleanup_phase(force, err_box):
+                for batch in _group_entries_by_depth(principal_entries):
+                    self._delete_entries_async(batch)
+
+            # remove replica memberPrincipal from s4u2proxy configuration
+            for (dn, service) in self._s4u2proxy_targets:
+                member_principal = "%s/%s@%s" % (service, replica, realm)
+                with _cleanup_phase(force, err_box):
+                    try:
+                        mod = [(ldap.MOD_DELETE, 'memberPrincipal',
+                                member_principal)]
+                        self.conn.modify_s(dn, mod)
+                    except (ldap.NO_SUCH_OBJECT, ldap.NO_SUCH_ATTRIBUTE):
+                        logger.debug("Replica (%s) memberPrincipal (%s) not "
+                                     "found in %s",
+                                     replica, member_principal, dn)
+
+            # delete master entry with all active services
+            with _cleanup_phase(force, err_box):
+                dn = DN(('cn', replica), self._masters_container_dn)
+                if dn not in self._cleanup_gone:
+                    try:
+                        self._delete_subtree(dn)
+                    except errors.NotFound:
+                        pass
+                    self._cleanup_gone.add(dn)
+
+            # remove the DNA configuration entries found by the combined
+            # search above; they are leaf config entries, so the whole batch
+            # can be pipelined at once
+            with _cleanup_phase(force, err_box):
+                self._delete_entries_async(dna_entries)
+
+            # delete DNS server configuration, if any
+            with _cleanup_phase(force, err_box):
+                api.Command.dnsserver_del(unicode(replica))
 
-        for (dn, member_principal) in ((dn1, member_principal1),
-                                       (dn2, member_principal2),
-                                       (dn3, member_principal3)):
             try:
-                mod = [(ldap.MOD_DELETE, 'memberPrincipal', member_principal)]
-                self.conn.modify_s(dn, mod)
-            except (ldap.NO_SUCH_OBJECT, ldap.NO_SUCH_ATTRIBUTE):
-                logger.debug("Replica (%s) memberPrincipal (%s) not found in "
-                             "%s",
-                             replica, member_principal, dn)
+                ret = self.conn.get_entry(self._default_profile_dn)
+                srvlist = ret.single_value.get('defaultServerList', '')
+                srvlist = srvlist.split()
+                if replica in srvlist:
+                    srvlist.remove(replica)
+                    attr = ' '.join(srvlist)
+                    ret['defaultServerList'] = attr
+                    self.conn.update_entry(ret)
+            except errors.NotFound:
+                pass
+            except errors.MidairCollision:
+                pass
+            except errors.EmptyModlist:
+                pass
             except Exception as e:
-                if not force:
+                if force and err_box[0]:
+                    raise err_box[0]   #pylint: disable=E0702
+                else:
                     raise e
-                elif not err:
-                    err = e
-
-        # delete master entry with all active services
-        try:
-            dn = DN(('cn', replica), api.env.container_masters, self.suffix)
-            entries = self.conn.get_entries(dn, ldap.SCOPE_SUBTREE)
-            if entries:
-                entries.sort(key=lambda x: len(x.dn), reverse=True)
-                for entry in entries:
-                    self.conn.delete_entry(entry)
-        except errors.NotFound:
-            pass
-        except Exception as e:
-            if not force:
-                raise e
-            elif not err:
-                err = e
-
-        try:
-            basedn = DN(('cn', 'etc'), self.suffix)
-            filter = '(dnaHostname=%s)' % replica
-            entries = self.conn.get_entries(
-                basedn, ldap.SCOPE_SUBTREE, filter=filter)
-            if len(entries) != 0:
-                for entry in entries:
-                    self.conn.delete_entry(entry)
-        except errors.NotFound:
-            pass
-        except Exception as e:
-            if not force:
-                raise e
-            elif not err:
-                err = e
-
-        # delete DNS server configuration, if any
-        try:
-            api.Command.dnsserver_del(unicode(replica))
-        except errors.NotFound:
-            pass
-        except Exception as e:
-            if not force:
-                raise e
-            elif not err:
-                err = e
-
-        try:
-            dn = DN(('cn', 'default'), ('ou', 'profile'), self.suffix)
-            ret = self.conn.get_entry(dn)
-            srvlist = ret.single_value.get('defaultServerList', '')
-            srvlist = srvlist.split()
-            if replica in srvlist:
-                srvlist.remove(replica)
-                attr = ' '.join(srvlist)
-                ret['defaultServerList'] = attr
-                self.conn.update_entry(ret)
-        except errors.NotFound:
-            pass
-        except errors.MidairCollision:
-            pass
-        except errors.EmptyModlist:
-            pass
-        except Exception as e:
-            if force and err:
-                raise err   #pylint: disable=E0702
-            else:
-                raise e
 
-        if err:
-            raise err   #pylint: disable=E0702
+        if err_box[0]:
+            raise err_box[0]   #pylint: disable=E0702
 
     def set_readonly(self, readonly, critical=False):
         """